@@ -18,8 +18,20 @@ interface Message {
   sender: "You" | "Bot" | "System";
   text: string;
   timestamp: Date;
+  streaming?: boolean;
 }
 
+// Frames sent by the server: complete messages, or a streamed reply as a
+// sequence of chunks terminated by an "end" frame. A "session" frame carries the
+// token that resumes this conversation on a later connection.
+type ServerFrame =
+  | { type: "session"; token: string }
+  | { type: "message"; text: string }
+  | { type: "chunk"; text: string }
+  | { type: "end" };
+
+const SESSION_TOKEN_KEY = "talentscout-session-token";
+
 export default function App() {
   const [messages, setMessages] = useState<Message[]>([]);
   const [input, setInput] = useState<string>("");
@@ -38,6 +50,14 @@ export default function App() {
 
     ws.current.onopen = () => {
       console.log("WebSocket connection established");
+      // The first frame carries the resume token; it is kept out of the URL so it
+      // never shows up in server access logs.
+      ws.current?.send(
+        JSON.stringify({
+          type: "session",
+          token: localStorage.getItem(SESSION_TOKEN_KEY),
+        })
+      );
       setIsConnecting(false);
       setMessages((prev) => [
         ...prev,
@@ -50,15 +70,41 @@ export default function App() {
     };
 
     ws.current.onmessage = (event: MessageEvent) => {
+      const frame: ServerFrame = JSON.parse(event.data);
+
+      if (frame.type === "session") {
+        localStorage.setItem(SESSION_TOKEN_KEY, frame.token);
+        return;
+      }
+
+      if (frame.type === "end") {
+        setMessages((prev) =>
+          prev.map((msg) =>
+            msg.streaming ? { ...msg, streaming: false } : msg
+          )
+        );
+        return;
+      }
+
       setIsTyping(false);
-      setMessages((prev) => [
-        ...prev,
-        {
-          sender: "Bot",
-          text: event.data,
-          timestamp: new Date(),
-        },
-      ]);
+      setMessages((prev) => {
+        const last = prev[prev.length - 1];
+        if (frame.type === "chunk" && last?.streaming) {
+          return [
+            ...prev.slice(0, -1),
+            { ...last, text: last.text + frame.text },
+          ];
+        }
+        return [
+          ...prev,
+          {
+            sender: "Bot",
+            text: frame.text,
+            timestamp: new Date(),
+            streaming: frame.type === "chunk",
+          },
+        ];
+      });
     };
 
     ws.current.onclose = () => {
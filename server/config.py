@@ -0,0 +1,6 @@
+from dotenv import load_dotenv
+
+# --- Configuration ---
+# Loaded in its own module, imported before anything under llms/, so module-level
+# settings and the Gemini client see the values from .env.
+load_dotenv()
@@ -0,0 +1,124 @@
+import re
+import base64
+import hashlib
+from typing import Dict, Any, Hashable, List, Optional, Sequence
+
+import numpy as np
+import orjson
+from cachetools import TTLCache
+from google.genai import types
+
+# Guardrail replies the system prompt mandates verbatim. They do not depend on
+# sampling, so they are safe to replay for the same state and user message.
+_GUARDRAIL_PATTERNS = re.compile(
+    r"^(?:"
+    r"I['’]m here to collect your information for PGAGI\. Right now I need your .+\. Can you share that with me\?"
+    r"|I['’]m your PGAGI hiring assistant\. Let['’]s focus on your application(?: - I need your .+\.|\. What['’]s your .+\?)"
+    r"|Let['’]s keep our conversation focused on your job application\. I need your .+\."
+    r")$"
+)
+
+
+class EmbeddingCache:
+    """
+    Per-session cache of replies keyed on the embedding of the user's message. A lookup
+    returns the reply for the most similar earlier message in the same conversation
+    state, if its cosine similarity clears the threshold. Least recently used entries
+    are evicted beyond `maxsize`.
+    """
+    def __init__(self, maxsize: int = 256, threshold: float = 0.92):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._vectors: Optional[np.ndarray] = None  # unit-normalized, one row per entry
+        self._states: List[str] = []
+        self._responses: List[str] = []
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def get(self, embedding: Sequence[float], state: str) -> Optional[str]:
+        if self._vectors is None:
+            return None
+        query = self._normalize(embedding)
+        scores = self._vectors @ query
+        scores[[s != state for s in self._states]] = -1.0
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        self._touch(best)
+        return self._responses[-1]
+
+    def add(self, embedding: Sequence[float], state: str, response: str) -> None:
+        vector = self._normalize(embedding)[np.newaxis, :]
+        self._vectors = vector if self._vectors is None else np.vstack((self._vectors, vector))
+        self._states.append(state)
+        self._responses.append(response)
+        if len(self._responses) > self.maxsize:
+            self._vectors = self._vectors[1:]
+            del self._states[0], self._responses[0]
+
+    def _touch(self, index: int) -> None:
+        """Moves an entry to the most recently used end."""
+        order = [i for i in range(len(self._responses)) if i != index] + [index]
+        self._vectors = self._vectors[order]
+        self._states = [self._states[i] for i in order]
+        self._responses = [self._responses[i] for i in order]
+
+
+class LLMCache:
+    """In-memory TTL cache of complete LLM replies."""
+    def __init__(self, maxsize: int, ttl: float):
+        self._entries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key: Hashable) -> Optional[str]:
+        return self._entries.get(key)
+
+    def set(self, key: Hashable, response: str) -> None:
+        self._entries[key] = response
+
+
+def request_key(session_state_text: str, contents: List[types.Content]) -> bytes:
+    """
+    Hashes everything that varies between requests. The static prompt is the same for
+    every request made by this process, so it is left out of the key.
+    """
+    digest = hashlib.blake2b(session_state_text.encode(), digest_size=16)
+    for content in contents:
+        digest.update(b"|" + content.role.encode() + b":" + content.parts[0].text.encode())
+    return digest.digest()
+
+
+def _state_key(session: Dict[str, Any], msgs: List[types.Content]) -> str:
+    """Hashes the given history messages with the missing fields and phase flags."""
+    payload = {
+        "msgs": [(m.role, m.parts[0].text) for m in msgs],
+        "missing": sorted(session["missing_fields"]),
+        "phase": (
+            session.get("tech_questions_asked", False),
+            session.get("tech_answers_collected", False),
+            session.get("application_completed", False),
+        ),
+    }
+    digest = hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).digest()
+    return base64.b64encode(digest).decode()
+
+
+def guardrail_key(session: Dict[str, Any]) -> str:
+    """
+    Keys a turn on what decides a guardrail reply: the last bot message, the user's
+    message, the fields still missing and the phase flags. The collected data is left
+    out, so the key must only be used for replies that never depend on it.
+    """
+    return _state_key(session, list(session["history"])[-2:])
+
+
+def conversation_state_key(session: Dict[str, Any]) -> str:
+    """Like `guardrail_key`, but without the user's message."""
+    return _state_key(session, list(session["history"])[-2:-1])
+
+
+def is_guardrail_response(response: str) -> bool:
+    """Whether a reply is one of the prompt's fixed guardrail responses."""
+    return _GUARDRAIL_PATTERNS.match(response.strip()) is not None
@@ -1,21 +1,64 @@
+"""
+PGAGI Hiring Assistant WebSocket server.
+
+Run with the uvloop event loop and httptools parser, e.g.
+`uvicorn main:app --loop uvloop --http httptools`. Add `--workers N` only together
+with REDIS_URL, so sessions survive reconnects that land on another worker.
+"""
+import os
+import queue
+import secrets
+import atexit
+import asyncio
 import logging
-from typing import Dict, Any
+from logging.handlers import QueueHandler, QueueListener
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+
+import orjson
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
 
-from llms.gemini import get_next_bot_response, REQUIRED_FIELDS
+import config  # noqa: F401  (loads .env; must precede the llms imports)
+from llms.gemini import aclose_http_client, stream_bot_response, to_content, INITIAL_GREETING, REQUIRED_FIELDS
+from session_store import SessionStore
 
 # --- Configuration ---
-load_dotenv()
 logging.basicConfig(level=logging.INFO)
+
+class _UnformattedQueueHandler(QueueHandler):
+    """
+    Enqueues records as they are. The stock `prepare` formats each record, traceback
+    included, on the logging thread; the queue never leaves this process, so the
+    listener's handlers can do all the formatting instead.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+# Hand log records to a background thread so formatting and I/O stay off the event loop.
+_root_logger = logging.getLogger()
+_log_queue: queue.Queue = queue.Queue(-1)
+_log_listener = QueueListener(_log_queue, *_root_logger.handlers, respect_handler_level=True)
+_root_logger.handlers = [_UnformattedQueueHandler(_log_queue)]
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
 logger = logging.getLogger(__name__)
 
 
 # --- Application Setup ---
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await aclose_http_client()
+    if session_store is not None:
+        await session_store.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,85 +68,221 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-EXIT_KEYWORDS = ["exit", "quit", "bye", "goodbye"]
+EXIT_KEYWORDS = frozenset(("exit", "quit", "bye", "goodbye"))
+
+# History entries kept per connection after the fixed greeting, which is never
+# stored; older turns are dropped as new ones arrive. Sized to hold a whole
+# application, since the model is sent the full stored history by default.
+MAX_STORED_HISTORY = 200
+
+# With REDIS_URL set, session state is written through to Redis so reconnects and
+# multiple workers share it. Without it, state lives only in this process.
+REDIS_URL = os.environ.get("REDIS_URL")
+session_store: Optional[SessionStore] = (
+    SessionStore(REDIS_URL, history_maxlen=MAX_STORED_HISTORY) if REDIS_URL else None
+)
+
+# Upper bound (in characters) and maximum wait (in ms) for a batch of streamed text
+# before it is sent to the client as one frame.
+STREAM_BATCH_BYTES = int(os.environ.get("STREAM_BATCH_BYTES", 64))
+STREAM_BATCH_MS = int(os.environ.get("STREAM_BATCH_MS", 40))
+
+# --- Streaming ---
+
+async def coalesce_chunks(stream: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Re-batches a stream of small text chunks so each WebSocket frame carries a useful
+    amount of text. A batch is flushed when it reaches the current size limit or has
+    waited STREAM_BATCH_MS. The limit starts at one character so the first token goes
+    out immediately, then grows 3x per flush up to STREAM_BATCH_BYTES.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = stream.__aiter__()
+    pending = asyncio.ensure_future(iterator.__anext__())
+    batch_size = 1
+    buffer: List[str] = []
+    buffered = 0
+    deadline = 0.0
+
+    try:
+        while True:
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if done:
+                try:
+                    chunk = pending.result()
+                except StopAsyncIteration:
+                    break
+                if not buffer:
+                    deadline = loop.time() + STREAM_BATCH_MS / 1000
+                buffer.append(chunk)
+                buffered += len(chunk)
+                pending = asyncio.ensure_future(iterator.__anext__())
+                if buffered < batch_size:
+                    continue
+
+            # Size limit reached or the batch timed out.
+            yield "".join(buffer)
+            buffer.clear()
+            buffered = 0
+            batch_size = min(batch_size * 3, STREAM_BATCH_BYTES)
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        pending.cancel()
 
 # --- Connection Management ---
 
 class ConnectionManager:
     """Manages active WebSocket connections and their dynamic conversation state."""
-    def __init__(self):
+    def __init__(self, store: Optional[SessionStore] = None):
         self.active_connections: Dict[WebSocket, Dict[str, Any]] = {}
+        self.store = store
 
-    async def connect(self, websocket: WebSocket):
-        """Accepts a new connection and initializes its state."""
+    @staticmethod
+    async def _read_session_frame(websocket: WebSocket) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Reads the client's opening frame, `{"type": "session", "token": ...}`, and returns
+        the token it carries. The token is a credential, so it travels in a frame rather
+        than the URL, which ends up in access logs. Any other opening frame is returned as
+        the first user message instead.
+        """
+        data = await websocket.receive_text()
+        try:
+            frame = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return None, data
+        if not isinstance(frame, dict) or frame.get("type") != "session":
+            return None, data
+        token = frame.get("token")
+        return (token if isinstance(token, str) else None), None
+
+    async def connect(self, websocket: WebSocket, client_id: str):
+        """
+        Accepts a new connection, initializes or restores its state and starts its worker.
+        Stored state is only restored for a session token this server issued; the client
+        id in the URL is a display label and is never used to look up state.
+        """
         await websocket.accept()
-        
-        initial_greeting = "Welcome to the PGAGI Hiring Assistant! I'm here to help with the initial screening process by gathering some information about you. We can chat naturally - feel free to ask questions at any time. To start, could you tell me your full name?"
-        
-        self.active_connections[websocket] = {
-            "history": [
-                {'role': 'user', 'parts': [{'text': 'Hello'}]},
-                {'role': 'model', 'parts': [{'text': initial_greeting}]}
-            ],
-            "collected_data": {field: None for field in REQUIRED_FIELDS},
-            "tech_questions_asked": False,
-            "tech_answers_collected": False
-        }
+        token, first_message = await self._read_session_frame(websocket)
+
+        session = await self.store.load(token) if self.store and token else None
+        if session is not None:
+            # Resuming a stored conversation; repeat the last bot message as a prompt.
+            logger.info(f"Resumed session for client #{client_id}.")
+            opening_message = session["history"][-1].parts[0].text if session["history"] else INITIAL_GREETING
+        else:
+            session = {
+                "history": deque(maxlen=MAX_STORED_HISTORY),
+                "collected_data": {field: None for field in REQUIRED_FIELDS},
+                "missing_fields": dict.fromkeys(REQUIRED_FIELDS),
+                "tech_questions_asked": False,
+                "tech_answers_collected": False
+            }
+            opening_message = INITIAL_GREETING
+            token = secrets.token_urlsafe(32)
+
+        # Each connection gets a FIFO of pending messages drained by its own task, so
+        # one user's messages are answered in order while other users run in parallel.
+        session["client_id"] = client_id
+        session["token"] = token
+        session["queue"] = asyncio.Queue()
+        self.active_connections[websocket] = session
+        session["worker"] = asyncio.create_task(self._drain(websocket))
+
         logger.info(f"New connection. Total clients: {len(self.active_connections)}")
-        await websocket.send_text(initial_greeting)
+        if self.store:
+            await websocket.send_json({"type": "session", "token": token})
+        await websocket.send_json({"type": "message", "text": opening_message})
+        if first_message is not None:
+            await session["queue"].put(first_message)
 
     def disconnect(self, websocket: WebSocket):
-        """Removes a connection."""
-        if websocket in self.active_connections:
-            del self.active_connections[websocket]
+        """Removes a connection and stops its worker."""
+        session = self.active_connections.pop(websocket, None)
+        if session is not None:
+            session["worker"].cancel()
             logger.info(f"Connection closed. Total clients: {len(self.active_connections)}")
 
     def get_session_data(self, websocket: WebSocket) -> Dict[str, Any]:
         return self.active_connections[websocket]
 
     async def handle_message(self, websocket: WebSocket, user_input: str):
+        """Queues an incoming message to be answered by the connection's worker."""
+        await self.get_session_data(websocket)["queue"].put(user_input)
+
+    async def finish(self, websocket: WebSocket):
+        """Waits until every queued message on the connection has been answered."""
+        await self.get_session_data(websocket)["queue"].join()
+
+    async def _drain(self, websocket: WebSocket):
+        """Answers the connection's queued messages one at a time, in arrival order."""
+        session = self.get_session_data(websocket)
+        pending = session["queue"]
+        while True:
+            user_input = await pending.get()
+            try:
+                await self._respond(websocket, session, user_input)
+            except Exception as e:
+                logger.error(f"Failed to answer client #{session['client_id']}: {e}", exc_info=logger.isEnabledFor(logging.DEBUG))
+            finally:
+                pending.task_done()
+
+    async def _respond(self, websocket: WebSocket, session: Dict[str, Any], user_input: str):
         """
-        Handles an incoming message by calling the Gemini processor
-        and managing session history.
+        Streams the Gemini processor's reply to one message to the client chunk by
+        chunk and manages session history.
         """
-        session = self.get_session_data(websocket)
-        session["history"].append({'role': 'user', 'parts': [{'text': user_input}]})
+        session["history"].append(to_content('user', user_input))
 
-        # Call the external processor to get the bot's response
-        bot_response = get_next_bot_response(session)
+        # Forward each chunk as soon as it arrives so the client sees the first
+        # tokens without waiting for the whole generation.
+        parts = []
+        async for chunk in coalesce_chunks(stream_bot_response(session)):
+            parts.append(chunk)
+            await websocket.send_json({"type": "chunk", "text": chunk})
+        await websocket.send_json({"type": "end"})
 
-        # Update history and send response back to the client
-        session["history"].append({'role': 'model', 'parts': [{'text': bot_response}]})
-        await websocket.send_text(bot_response)
+        # Update history with the complete response
+        bot_response = "".join(parts).strip()
+        session["history"].append(to_content('model', bot_response))
         logger.info(f"Sent bot response: {bot_response}")
 
+        if self.store:
+            await self.store.save(session["token"], session)
 
-manager = ConnectionManager()
+
+manager = ConnectionManager(session_store)
 
 # --- API Endpoints ---
 
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    """Main WebSocket endpoint for handling the chat conversation."""
-    await manager.connect(websocket)
+    """
+    Main WebSocket endpoint for handling the chat conversation. The client opens with a
+    "session" frame carrying the token from an earlier connection, if any, to resume it.
+    """
     try:
+        await manager.connect(websocket, client_id)
         while True:
             data = await websocket.receive_text()
             logger.info(f"Received from client #{client_id}: {data}")
 
-            if data.lower().strip() in EXIT_KEYWORDS:
-                await websocket.send_text("Thank you for your time. Ending conversation.")
+            if data.strip().casefold() in EXIT_KEYWORDS:
+                # Let replies to earlier messages finish before saying goodbye.
+                await manager.finish(websocket)
+                await websocket.send_json({"type": "message", "text": "Thank you for your time. Ending conversation."})
                 break
 
             await manager.handle_message(websocket, data)
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
         logger.info(f"Client #{client_id} disconnected.")
     except Exception as e:
-        logger.error(f"An error occurred with client #{client_id}: {e}", exc_info=True)
-        manager.disconnect(websocket)
+        logger.error(f"An error occurred with client #{client_id}: {e}", exc_info=logger.isEnabledFor(logging.DEBUG))
     finally:
+        manager.disconnect(websocket)
         await websocket.close()
 
 @app.get("/")
@@ -0,0 +1,63 @@
+from collections import deque
+from typing import Dict, Any, Optional
+
+import orjson
+from redis import asyncio as aioredis
+
+from llms.gemini import to_content
+
+# Idle sessions expire from Redis after this many seconds.
+SESSION_TTL_SECONDS = 3600
+
+# Conversation phase flags carried alongside the collected data.
+PHASE_FLAGS = ("tech_questions_asked", "tech_answers_collected", "application_completed")
+
+
+class SessionStore:
+    """
+    Persists conversation state in Redis hashes keyed by a server-issued session token,
+    so a reconnect presenting the token, possibly landing on another worker, resumes
+    the same conversation. Only the serializable state is stored; per-process caches
+    are rebuilt on demand.
+    """
+    def __init__(self, url: str, history_maxlen: int):
+        self._redis = aioredis.from_url(url)
+        self._history_maxlen = history_maxlen
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return f"sess:{token}"
+
+    async def load(self, token: str) -> Optional[Dict[str, Any]]:
+        """Returns the stored session for `token`, or None if there is none."""
+        data = await self._redis.hgetall(self._key(token))
+        if not data:
+            return None
+
+        session = {
+            "history": deque(
+                (to_content(role, text) for role, text in orjson.loads(data[b"history"])),
+                maxlen=self._history_maxlen,
+            ),
+            "collected_data": orjson.loads(data[b"collected_data"]),
+            "missing_fields": dict.fromkeys(orjson.loads(data[b"missing_fields"])),
+        }
+        session.update(orjson.loads(data[b"phase"]))
+        return session
+
+    async def save(self, token: str, session: Dict[str, Any]) -> None:
+        """Writes the session through to Redis and refreshes its TTL."""
+        key = self._key(token)
+        mapping = {
+            "history": orjson.dumps([(c.role, c.parts[0].text) for c in session["history"]]),
+            "collected_data": orjson.dumps(session["collected_data"]),
+            "missing_fields": orjson.dumps(list(session["missing_fields"])),
+            "phase": orjson.dumps({flag: session.get(flag, False) for flag in PHASE_FLAGS}),
+        }
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, SESSION_TTL_SECONDS)
+            await pipe.execute()
+
+    async def close(self) -> None:
+        await self._redis.aclose()
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# The server imports its modules relative to server/, and llms.gemini refuses to load
+# without an API key. No test talks to Gemini.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+
+@pytest.fixture
+def generate(monkeypatch):
+    """
+    Takes Gemini offline: fresh reply caches, no prompt cache, and every generation
+    yields the text last passed to the returned function.
+    """
+    import llms.gemini as gemini
+    from llms.cache import LLMCache
+
+    monkeypatch.setattr(gemini, "_RESPONSE_CACHE", LLMCache(maxsize=16, ttl=60))
+    monkeypatch.setattr(gemini, "_GUARDRAIL_CACHE", LLMCache(maxsize=16, ttl=60))
+    monkeypatch.setattr(gemini, "_current_client", lambda: None)
+
+    async def no_cached_prompt(client):
+        return None
+    monkeypatch.setattr(gemini, "_cached_prompt_name", no_cached_prompt)
+
+    def set_reply(reply):
+        async def fake_generate_text(client, contents, config, single_shot):
+            yield reply
+        monkeypatch.setattr(gemini, "_generate_text", fake_generate_text)
+    return set_reply
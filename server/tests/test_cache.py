@@ -0,0 +1,58 @@
+import asyncio
+from collections import deque
+
+import pytest
+
+import llms.gemini as gemini
+from llms.gemini import REQUIRED_FIELDS, stream_bot_response, to_content
+
+QUESTIONS = "Based on your Python, here are some technical questions:\n\n1. What is the GIL?"
+GUARDRAIL_REPLY = "I'm here to collect your information for PGAGI. Right now I need your Phone Number. Can you share that with me?"
+
+
+def reply_to(session):
+    async def collect():
+        return "".join([text async for text in stream_bot_response(session)])
+    return asyncio.run(collect())
+
+
+def make_session(name, email, history, missing=()):
+    collected = {field: f"{name}'s {field}" for field in REQUIRED_FIELDS}
+    collected.update({"Full Name": name, "Email Address": email})
+    for field in missing:
+        collected[field] = None
+    return {
+        "history": deque(to_content(role, text) for role, text in history),
+        "collected_data": collected,
+        "missing_fields": dict.fromkeys(missing),
+        "tech_questions_asked": True,
+        "tech_answers_collected": False,
+    }
+
+
+@pytest.mark.parametrize("temperature", [0.7, 0])
+def test_replies_do_not_cross_sessions(monkeypatch, generate, temperature):
+    monkeypatch.setattr(gemini, "TEMPERATURE", temperature)
+    history = [("model", QUESTIONS), ("user", "I don't know")]
+    alice = make_session("Alice Smith", "alice@example.com", history)
+    bob = make_session("Bob Jones", "bob@example.com", history)
+
+    generate("Thank you! Your application is complete. Summary: Alice Smith, alice@example.com")
+    assert "Alice" in reply_to(alice)
+
+    generate("Thank you! Your application is complete. Summary: Bob Jones, bob@example.com")
+    reply = reply_to(bob)
+    assert "Bob Jones" in reply
+    assert "Alice" not in reply and "alice@example.com" not in reply
+
+
+def test_fixed_guardrail_replies_are_shared(generate):
+    history = [("model", "Thank you! I have your Email Address. Now I need your Phone Number."), ("user", "what is the salary")]
+    alice = make_session("Alice Smith", "alice@example.com", history, missing=REQUIRED_FIELDS[2:])
+    bob = make_session("Bob Jones", "bob@example.com", history, missing=REQUIRED_FIELDS[2:])
+
+    generate(GUARDRAIL_REPLY)
+    assert reply_to(alice) == GUARDRAIL_REPLY
+
+    generate("generated again")
+    assert reply_to(bob) == GUARDRAIL_REPLY
@@ -0,0 +1,22 @@
+import asyncio
+
+from llms.gemini import _current_client, _loop_clients, aclose_http_client
+
+
+def test_each_event_loop_gets_its_own_client():
+    async def clients():
+        first, second = _current_client(), _current_client()
+        assert first is second
+        return first
+
+    assert asyncio.run(clients()) is not asyncio.run(clients())
+
+
+def test_aclose_http_client_closes_the_running_loops_client():
+    async def open_and_close():
+        _current_client()
+        http_client = _loop_clients[asyncio.get_running_loop()][1]
+        await aclose_http_client()
+        return http_client
+
+    assert asyncio.run(open_and_close()).is_closed